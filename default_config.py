@@ -19,6 +19,8 @@ def get_default_config():
     cfg.data.sources = ['market1501']
     cfg.data.targets = ['market1501']
     cfg.data.workers = 10 # number of data loading workers
+    cfg.data.persistent_workers = False # keep train loader workers alive across epochs (image data only)
+    cfg.data.prefetch_factor = 2 # batches loaded in advance by each train loader worker (image data only)
     cfg.data.split_id = 0 # split index
     cfg.data.height = 256 # image height
     cfg.data.width = 128 # image width
@@ -58,6 +60,9 @@ def get_default_config():
     cfg.train.fixbase_epoch = 0 # number of epochs to fix base layers
     cfg.train.open_layers = ['classifier'] # layers for training while keeping others frozen
     cfg.train.staged_lr = False # set different lr to different layers
+    cfg.train.amp = False # train with fp16 autocast and a gradient scaler (drop-batch engines, gpu only)
+    cfg.train.compile_model = False # compile the training forward with torch.compile (drop-batch engines, PyTorch 2.x)
+    cfg.train.allow_tf32 = False # use TF32 for matmuls and convolutions on Ampere or newer gpus; False keeps them in full fp32 (process-wide, also affects evaluation)
     cfg.train.new_layers = ['classifier'] # newly added layers with default lr
     cfg.train.base_lr_mult = 0.1 # learning rate multiplier for base layers
     cfg.train.lr_scheduler = 'single_step'
@@ -147,6 +152,8 @@ def imagedata_kwargs(cfg):
         'cuhk03_labeled': cfg.cuhk03.labeled_images,
         'cuhk03_classic_split': cfg.cuhk03.classic_split,
         'market1501_500k': cfg.market1501.use_500k_distractors,
+        'persistent_workers': cfg.data.persistent_workers,
+        'prefetch_factor': cfg.data.prefetch_factor,
     }
 
 
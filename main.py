@@ -48,6 +48,8 @@ def build_engine(cfg, datamanager, model, optimizer, scheduler):
                 weight_db_t=cfg.loss.dropbatch.weight_db_t,
                 weight_db_x=cfg.loss.dropbatch.weight_db_x,
                 top_drop_epoch=cfg.loss.dropbatch.top_drop_epoch,
+                compile_model=cfg.train.compile_model,
+                use_amp=cfg.train.amp,
                 scheduler=scheduler,
                 use_gpu=cfg.use_gpu,
                 label_smooth=cfg.loss.softmax.label_smooth
@@ -65,6 +67,8 @@ def build_engine(cfg, datamanager, model, optimizer, scheduler):
                 weight_b_db_t=cfg.loss.dropbatch.weight_b_db_t,
                 weight_b_db_x=cfg.loss.dropbatch.weight_b_db_x,
                 top_drop_epoch=cfg.loss.dropbatch.top_drop_epoch,
+                compile_model=cfg.train.compile_model,
+                use_amp=cfg.train.amp,
                 scheduler=scheduler,
                 use_gpu=cfg.use_gpu,
                 label_smooth=cfg.loss.softmax.label_smooth
@@ -154,6 +158,9 @@ def main():
     
     if cfg.use_gpu:
         torch.backends.cudnn.benchmark = True
+        # set explicitly, as the PyTorch defaults for both flags vary across releases
+        torch.backends.cuda.matmul.allow_tf32 = cfg.train.allow_tf32
+        torch.backends.cudnn.allow_tf32 = cfg.train.allow_tf32
     
     datamanager = build_datamanager(cfg)
     
@@ -177,11 +184,11 @@ def main():
     optimizer = torchreid.optim.build_optimizer(model, **optimizer_kwargs(cfg))
     scheduler = torchreid.optim.build_lr_scheduler(optimizer, **lr_scheduler_kwargs(cfg))
 
-    if cfg.model.resume and check_isfile(cfg.model.resume):
-        args.start_epoch = resume_from_checkpoint(cfg.model.resume, model, optimizer=optimizer)
-
     print('Building {}-engine for {}-reid'.format(cfg.loss.name, cfg.data.type))
     engine = build_engine(cfg, datamanager, model, optimizer, scheduler)
+
+    if cfg.model.resume and check_isfile(cfg.model.resume):
+        args.start_epoch = resume_from_checkpoint(cfg.model.resume, model, optimizer=optimizer, scaler=engine.scaler)
     engine.run(**engine_run_kwargs(cfg))
 
 
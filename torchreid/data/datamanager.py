@@ -105,6 +105,12 @@ class ImageDataManager(DataManager):
             Default is False.
         market1501_500k (bool, optional): add 500K distractors to the gallery
             set in market1501. Default is False.
+        persistent_workers (bool, optional): keep the train loader workers alive across
+            epochs. Only passed to the DataLoader when ``workers > 0``, and needs
+            PyTorch >= 1.7 when enabled. Default is False.
+        prefetch_factor (int, optional): number of batches loaded in advance by each
+            train loader worker. Only passed to the DataLoader when ``workers > 0`` and
+            it differs from 2, in which case it needs PyTorch >= 1.7. Default is 2.
 
     Examples::
 
@@ -122,7 +128,8 @@ class ImageDataManager(DataManager):
     def __init__(self, root='', sources=None, targets=None, height=256, width=128, transforms='random_flip',
                  norm_mean=None, norm_std=None, use_gpu=True, split_id=0, combineall=False,
                  batch_size_train=32, batch_size_test=32, workers=4, num_instances=4, train_sampler='',
-                 cuhk03_labeled=False, cuhk03_classic_split=False, market1501_500k=False):
+                 cuhk03_labeled=False, cuhk03_classic_split=False, market1501_500k=False,
+                 persistent_workers=False, prefetch_factor=2):
         
         super(ImageDataManager, self).__init__(sources=sources, targets=targets, height=height, width=width,
                                                transforms=transforms, norm_mean=norm_mean, norm_std=norm_std,
@@ -154,6 +161,14 @@ class ImageDataManager(DataManager):
             num_instances=num_instances
         )
 
+        # only passed when changed from the DataLoader defaults, as older PyTorch
+        # releases do not accept them and they are invalid without workers
+        train_loader_kwargs = {}
+        if workers > 0 and persistent_workers:
+            train_loader_kwargs['persistent_workers'] = True
+        if workers > 0 and prefetch_factor != 2:
+            train_loader_kwargs['prefetch_factor'] = prefetch_factor
+
         self.trainloader = torch.utils.data.DataLoader(
             trainset,
             sampler=train_sampler,
@@ -161,7 +176,8 @@ class ImageDataManager(DataManager):
             shuffle=False,
             num_workers=workers,
             pin_memory=self.use_gpu,
-            drop_last=True
+            drop_last=True,
+            **train_loader_kwargs
         )
 
         print('=> Loading test (target) dataset')
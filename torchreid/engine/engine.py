@@ -7,6 +7,7 @@ import os
 import os.path as osp
 import time
 import datetime
+import warnings
 import numpy as np
 import cv2
 from matplotlib import pyplot as plt
@@ -27,6 +28,67 @@ GRID_SPACING = 10
 VECT_HEIGTH = 10
 
 
+class DataPrefetcher(object):
+    r"""Iterates over a train loader while copying the next batch to the gpu
+    on a side stream, so the host-to-device copy overlaps with the compute of
+    the current batch. Falls back to plain iteration when ``use_gpu`` is False.
+
+    The loader should use ``pin_memory=True`` for the copies to be asynchronous.
+
+    Args:
+        loader (DataLoader): train loader.
+        parse_data (callable): maps a loader batch to ``(imgs, pids)``.
+        use_gpu (bool, optional): use gpu. Default is True.
+        memory_format (torch.memory_format, optional): memory format the images are
+            converted to on the gpu, e.g. ``torch.channels_last``. Default is None
+            (layout is kept).
+    """
+
+    def __init__(self, loader, parse_data, use_gpu=True, memory_format=None):
+        self.loader = loader
+        self.parse_data = parse_data
+        self.use_gpu = use_gpu
+        self.memory_format = memory_format
+        self.stream = torch.cuda.Stream() if use_gpu else None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self.iter = iter(self.loader)
+        self.preload()
+        return self
+
+    def preload(self):
+        try:
+            imgs, pids = self.parse_data(next(self.iter))
+        except StopIteration:
+            self.next_batch = None
+            return
+        if self.use_gpu:
+            with torch.cuda.stream(self.stream):
+                imgs = imgs.cuda(non_blocking=True)
+                if self.memory_format is not None:
+                    imgs = imgs.contiguous(memory_format=self.memory_format)
+                pids = pids.cuda(non_blocking=True)
+        self.next_batch = (imgs, pids)
+
+    def __next__(self):
+        if self.next_batch is None:
+            raise StopIteration
+        imgs, pids = self.next_batch
+        if self.use_gpu:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_stream(self.stream)
+            # the tensors were allocated on the side stream but are consumed here
+            imgs.record_stream(current_stream)
+            pids.record_stream(current_stream)
+        self.preload()
+        return imgs, pids
+
+    next = __next__  # python 2 compatibility
+
+
 class Engine(object):
     r"""A generic base Engine class for both image- and video-reid.
 
@@ -46,6 +108,7 @@ class Engine(object):
         self.scheduler = scheduler
         self.use_gpu = (torch.cuda.is_available() and use_gpu)
         self.writer = None
+        self.scaler = None # set by engines that train with mixed precision
 
         # check attributes
         if not isinstance(self.model, nn.Module):
@@ -609,6 +672,44 @@ class Engine(object):
             loss = criterion(outputs, targets)
         return loss
 
+    def _compute_head_losses(self, criterion, inputs, targets, active):
+        """Evaluates ``criterion`` once on the stacked inputs of the active heads
+        and returns one loss per head, zero for the inactive ones."""
+        losses = [targets.new_zeros((), dtype=torch.float)] * len(inputs)
+        indices = [i for i, is_active in enumerate(active) if is_active]
+        if indices:
+            head_losses = criterion(torch.stack([inputs[i] for i in indices]), targets)
+            for i, head_loss in zip(indices, head_losses):
+                losses[i] = head_loss
+        return losses
+
+    def _setup_train_forward(self, compile_model=False, use_amp=False):
+        """Prepares the model for the training loops of the drop-batch engines.
+
+        Sets ``self.scaler`` and ``self.use_amp``, converts the model to channels_last
+        on gpu and defines ``self._fwd_drop``/``self._fwd_nodrop``, the training
+        forwards with ``drop_top`` fixed to True/False, compiled if ``compile_model``.
+        """
+        # mixed precision is only used on gpu, the scaler is a no-op otherwise
+        self.use_amp = use_amp and self.use_gpu
+        self.scaler = torch.cuda.amp.GradScaler(enabled=self.use_amp)
+        if self.use_gpu:
+            # NHWC layout lets cudnn pick tensor-core friendly conv kernels
+            self.model = self.model.to(memory_format=torch.channels_last)
+
+        # the training forward is compiled separately so that self.model, its
+        # state_dict and the eval/visualization paths stay untouched; drop_top is
+        # bound in two callables so each compiled graph sees it as a constant
+        self._fwd_drop = lambda imgs: self.model(imgs, drop_top=True)
+        self._fwd_nodrop = lambda imgs: self.model(imgs, drop_top=False)
+        if compile_model:
+            if self.use_gpu and hasattr(torch, 'compile') and torch.cuda.get_device_capability()[0] >= 7:
+                self._fwd_drop = torch.compile(self._fwd_drop)
+                self._fwd_nodrop = torch.compile(self._fwd_nodrop)
+            else:
+                warnings.warn('compile_model is ignored: torch.compile needs PyTorch 2.x and '
+                              'a gpu with compute capability >= 7.0')
+
     def _extract_features(self, input):
         self.model.eval()
         return self.model(input)
@@ -655,9 +756,12 @@ class Engine(object):
         return imgs, pids, camids
 
     def _save_checkpoint(self, epoch, rank1, save_dir, is_best=False):
-        save_checkpoint({
+        state = {
             'state_dict': self.model.state_dict(),
             'epoch': epoch + 1,
             'rank1': rank1,
             'optimizer': self.optimizer.state_dict(),
-        }, save_dir, is_best=is_best)
+        }
+        if self.scaler is not None and self.scaler.is_enabled():
+            state['scaler'] = self.scaler.state_dict()
+        save_checkpoint(state, save_dir, is_best=is_best)
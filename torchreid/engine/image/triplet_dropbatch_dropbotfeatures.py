@@ -11,7 +11,6 @@ import torchreid
 from torchreid.engine import engine
 from torchreid.losses import CrossEntropyLoss, TripletLoss, NPairsLoss
 from torchreid.utils import AverageMeter, open_specified_layers, open_all_layers
-from torchreid import metrics
 
 
 class ImageTripletDropBatchDropBotFeaturesEngine(engine.Engine):
@@ -28,6 +27,13 @@ class ImageTripletDropBatchDropBotFeaturesEngine(engine.Engine):
         scheduler (LRScheduler, optional): if None, no learning rate decay will be performed.
         use_gpu (bool, optional): use gpu. Default is True.
         label_smooth (bool, optional): use label smoothing regularizer. Default is True.
+        top_drop_epoch (int, optional): epoch from which the top activated rows are dropped
+            instead of random ones. Default is -1 (never).
+        compile_model (bool, optional): compile the training forward with ``torch.compile``.
+            Requires PyTorch 2.x and a gpu with compute capability >= 7.0, otherwise it is
+            ignored with a warning. Default is False.
+        use_amp (bool, optional): train with fp16 autocast and a gradient scaler on gpu.
+            Default is False.
 
     Examples::
         
@@ -70,8 +76,9 @@ class ImageTripletDropBatchDropBotFeaturesEngine(engine.Engine):
 
     def __init__(self, datamanager, model, optimizer, margin=0.3,
                  weight_t=1, weight_x=1, weight_db_t=1, weight_db_x=1, weight_b_db_t=1, weight_b_db_x=1, scheduler=None, use_gpu=True,
-                 label_smooth=True, top_drop_epoch=-1):
+                 label_smooth=True, top_drop_epoch=-1, compile_model=False, use_amp=False):
         super(ImageTripletDropBatchDropBotFeaturesEngine, self).__init__(datamanager, model, optimizer, scheduler, use_gpu)
+        self._setup_train_forward(compile_model=compile_model, use_amp=use_amp)
 
         self.weight_t = weight_t
         self.weight_x = weight_x
@@ -80,6 +87,22 @@ class ImageTripletDropBatchDropBotFeaturesEngine(engine.Engine):
         self.weight_b_db_t = weight_b_db_t
         self.weight_b_db_x = weight_b_db_x
         self.top_drop_epoch = top_drop_epoch
+        # loss weights in the order of the stacked loss vector used in train
+        self._loss_weights = torch.tensor(
+            [weight_t, weight_x, weight_db_t, weight_db_x, weight_b_db_t, weight_b_db_x],
+            dtype=torch.float, device='cuda' if self.use_gpu else 'cpu'
+        )
+        # zero-weighted terms are not evaluated at all
+        self._active = {
+            't': weight_t != 0,
+            'x': weight_x != 0,
+            'db_t': weight_db_t != 0,
+            'db_x': weight_db_x != 0,
+            'b_db_t': weight_b_db_t != 0,
+            'b_db_x': weight_b_db_x != 0
+        }
+        if not any(self._active.values()):
+            raise ValueError('At least one loss weight must be non-zero')
 
         self.criterion_t = TripletLoss(margin=margin)
         self.criterion_x = CrossEntropyLoss(
@@ -87,18 +110,6 @@ class ImageTripletDropBatchDropBotFeaturesEngine(engine.Engine):
             use_gpu=self.use_gpu,
             label_smooth=label_smooth
         )
-        self.criterion_db_t = TripletLoss(margin=margin)
-        self.criterion_db_x = CrossEntropyLoss(
-            num_classes=self.datamanager.num_train_pids,
-            use_gpu=self.use_gpu,
-            label_smooth=label_smooth
-        )
-        self.criterion_b_db_t = TripletLoss(margin=margin)
-        self.criterion_b_db_x = CrossEntropyLoss(
-            num_classes=self.datamanager.num_train_pids,
-            use_gpu=self.use_gpu,
-            label_smooth=label_smooth
-        )
 
     def train(self, epoch, max_epoch, trainloader, fixbase_epoch=0, open_layers=None, print_freq=10):
         losses_t = AverageMeter()
@@ -112,6 +123,8 @@ class ImageTripletDropBatchDropBotFeaturesEngine(engine.Engine):
         data_time = AverageMeter()
 
         self.model.train()
+        # the learning rate only changes at scheduler.step()
+        self._cached_lr = self.optimizer.param_groups[0]['lr']
         if (epoch+1)<=fixbase_epoch and open_layers is not None:
             print('* Only train {} (epoch: {}/{})'.format(open_layers, epoch+1, fixbase_epoch))
             open_specified_layers(self.model, open_layers)
@@ -119,39 +132,65 @@ class ImageTripletDropBatchDropBotFeaturesEngine(engine.Engine):
             open_all_layers(self.model)
 
         num_batches = len(trainloader)
-        end = time.time()
-        for batch_idx, data in enumerate(trainloader):
-            data_time.update(time.time() - end)
-
-            imgs, pids = self._parse_data_for_train(data)
-            if self.use_gpu:
-                imgs = imgs.cuda()
-                pids = pids.cuda()
-
-            self.optimizer.zero_grad()
-            drop_top = (self.top_drop_epoch != -1) and ((epoch+1) >= self.top_drop_epoch)
-            outputs, features, db_prelogits, db_features, b_db_prelogits, b_db_features = self.model(imgs, drop_top = drop_top)
-            loss_t = self._compute_loss(self.criterion_t, features, pids)
-            loss_x = self._compute_loss(self.criterion_x, outputs, pids)
-            loss_db_x = self._compute_loss(self.criterion_db_x, db_prelogits, pids)
-            loss_db_t = self._compute_loss(self.criterion_db_t, db_features, pids)
-            loss_b_db_x = self._compute_loss(self.criterion_b_db_x, b_db_prelogits, pids)
-            loss_b_db_t = self._compute_loss(self.criterion_b_db_t, b_db_features, pids)
-            loss = self.weight_t * loss_t + self.weight_x * loss_x + self.weight_db_t * loss_db_t + self.weight_db_x * loss_db_x + self.weight_b_db_t * loss_b_db_t + self.weight_b_db_x * loss_b_db_x
-            loss.backward()
-            self.optimizer.step()
-
-            batch_time.update(time.time() - end)
-
-            losses_t.update(loss_t.item(), pids.size(0))
-            losses_x.update(loss_x.item(), pids.size(0))
-            losses_db_t.update(loss_db_t.item(), pids.size(0))
-            losses_db_x.update(loss_db_x.item(), pids.size(0))
-            losses_b_db_t.update(loss_b_db_t.item(), pids.size(0))
-            losses_b_db_x.update(loss_b_db_x.item(), pids.size(0))
-            accs.update(metrics.accuracy(outputs, pids)[0].item())
+        # per-iteration losses and accuracy are kept on the device and only
+        # copied to the host every print_freq iterations to avoid a sync per step
+        loss_buf = torch.zeros(7, print_freq, device='cuda' if self.use_gpu else 'cpu')
+        # drop_top only depends on the epoch
+        drop_top = (self.top_drop_epoch != -1) and ((epoch+1) >= self.top_drop_epoch)
+        forward = self._fwd_drop if drop_top else self._fwd_nodrop
+        prefetcher = engine.DataPrefetcher(
+            trainloader, self._parse_data_for_train, self.use_gpu,
+            memory_format=torch.channels_last
+        )
+        # batch_time is the host wall time between consecutive iterations; gpu work
+        # is not synchronized, so it reflects steady-state throughput, not per-step latency.
+        # The first iteration of an epoch is left out, as it includes the compilation of
+        # the forward selected for the epoch (and the prefetcher and worker start-up)
+        end = time.perf_counter()
+        for batch_idx, (imgs, pids) in enumerate(prefetcher):
+            data_time.update(time.perf_counter() - end)
+
+            self.optimizer.zero_grad(set_to_none=True)
+            with torch.cuda.amp.autocast(enabled=self.use_amp):
+                outputs, features, db_prelogits, db_features, b_db_prelogits, b_db_features = forward(imgs)
+            # identity masks are shared by all triplet heads
+            pos_mask = pids.unsqueeze(0).eq(pids.unsqueeze(1))
+            neg_mask = ~pos_mask
+            zero = pids.new_zeros((), dtype=torch.float)
+            loss_t = self.criterion_t(features, pids, pos_mask=pos_mask, neg_mask=neg_mask) if self._active['t'] else zero
+            loss_db_t = self.criterion_t(db_features, pids, pos_mask=pos_mask, neg_mask=neg_mask) if self._active['db_t'] else zero
+            loss_b_db_t = self.criterion_t(b_db_features, pids, pos_mask=pos_mask, neg_mask=neg_mask) if self._active['b_db_t'] else zero
+            # the three classifier heads share num_classes, so their logits are
+            # stacked and go through a single cross entropy call
+            loss_x, loss_db_x, loss_b_db_x = self._compute_head_losses(
+                self.criterion_x, [outputs, db_prelogits, b_db_prelogits],
+                pids, [self._active['x'], self._active['db_x'], self._active['b_db_x']]
+            )
+            loss_vec = torch.stack([loss_t, loss_x, loss_db_t, loss_db_x, loss_b_db_t, loss_b_db_x])
+            loss = torch.dot(self._loss_weights, loss_vec)
+            self.scaler.scale(loss).backward()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+
+            now = time.perf_counter()
+            if batch_idx > 0:
+                batch_time.update(now - end)
+            end = now
+
+            acc = (outputs.argmax(1) == pids).float().mean() * 100
+            loss_buf[:, batch_idx % print_freq] = torch.cat([loss_vec, acc.unsqueeze(0)]).detach()
 
             if (batch_idx+1) % print_freq == 0:
+                vals = loss_buf.mean(1).tolist()
+                n = pids.size(0) * print_freq
+                losses_t.update(vals[0], n)
+                losses_x.update(vals[1], n)
+                losses_db_t.update(vals[2], n)
+                losses_db_x.update(vals[3], n)
+                losses_b_db_t.update(vals[4], n)
+                losses_b_db_x.update(vals[5], n)
+                accs.update(vals[6], print_freq)
+
                 # estimate remaining time
                 eta_seconds = batch_time.avg * (num_batches-(batch_idx+1) + (max_epoch-(epoch+1))*num_batches)
                 eta_str = str(datetime.timedelta(seconds=int(eta_seconds)))
@@ -177,25 +216,28 @@ class ImageTripletDropBatchDropBotFeaturesEngine(engine.Engine):
                       loss_b_db_t=losses_b_db_t,
                       loss_b_db_x=losses_b_db_x,
                       acc=accs,
-                      lr=self.optimizer.param_groups[0]['lr'],
+                      lr=self._cached_lr,
                       eta=eta_str
                     )
                 )
 
-            if self.writer is not None:
-                n_iter = epoch * num_batches + batch_idx
-                self.writer.add_scalar('Train/Time', batch_time.avg, n_iter)
-                self.writer.add_scalar('Train/Data', data_time.avg, n_iter)
-                self.writer.add_scalar('Train/Loss_t', losses_t.avg, n_iter)
-                self.writer.add_scalar('Train/Loss_x', losses_x.avg, n_iter)
-                self.writer.add_scalar('Train/Loss_db_t', losses_db_t.avg, n_iter)
-                self.writer.add_scalar('Train/Loss_db_x', losses_db_x.avg, n_iter)
-                self.writer.add_scalar('Train/Loss_b_db_t', losses_b_db_t.avg, n_iter)
-                self.writer.add_scalar('Train/Loss_b_db_x', losses_b_db_x.avg, n_iter)
-                self.writer.add_scalar('Train/Acc glob', accs.avg, n_iter)
-                self.writer.add_scalar('Train/Lr', self.optimizer.param_groups[0]['lr'], n_iter)
-            
-            end = time.time()
+                if self.writer is not None:
+                    n_iter = epoch * num_batches + batch_idx
+                    self.writer.add_scalars('Train/Loss', {
+                        't': losses_t.avg,
+                        'x': losses_x.avg,
+                        'db_t': losses_db_t.avg,
+                        'db_x': losses_db_x.avg,
+                        'b_db_t': losses_b_db_t.avg,
+                        'b_db_x': losses_b_db_x.avg
+                    }, n_iter)
+                    self.writer.add_scalars('Train/Meta', {
+                        'time': batch_time.avg,
+                        'data': data_time.avg,
+                        'acc_glob': accs.avg,
+                        'lr': self._cached_lr
+                    }, n_iter)
 
         if self.scheduler is not None:
             self.scheduler.step()
+            self._cached_lr = self.optimizer.param_groups[0]['lr']
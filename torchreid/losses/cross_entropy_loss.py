@@ -24,7 +24,8 @@ class CrossEntropyLoss(nn.Module):
     Args:
         num_classes (int): number of classes.
         epsilon (float, optional): weight. Default is 0.1.
-        use_gpu (bool, optional): whether to use gpu devices. Default is True.
+        use_gpu (bool, optional): ignored, kept for backward compatibility. Targets are
+            built on the device of the inputs.
         label_smooth (bool, optional): whether to apply label smoothing. Default is True.
     """
     
@@ -33,18 +34,20 @@ class CrossEntropyLoss(nn.Module):
         self.num_classes = num_classes
         self.epsilon = epsilon if label_smooth else 0
         self.use_gpu = use_gpu
-        self.logsoftmax = nn.LogSoftmax(dim=1)
+        self.logsoftmax = nn.LogSoftmax(dim=-1)
 
     def forward(self, inputs, targets):
         """
         Args:
             inputs (torch.Tensor): prediction matrix (before softmax) with
-                shape (batch_size, num_classes).
+                shape (batch_size, num_classes). Predictions of several heads
+                can be stacked to shape (num_heads, batch_size, num_classes),
+                in which case a loss vector of shape (num_heads) is returned.
             targets (torch.LongTensor): ground truth labels with shape (batch_size).
                 Each position contains the label index.
         """
-        log_probs = self.logsoftmax(inputs)
-        targets = torch.zeros(log_probs.size()).scatter_(1, targets.unsqueeze(1).data.cpu(), 1)
-        if self.use_gpu: targets = targets.cuda()
+        log_probs = self.logsoftmax(inputs.float())
+        targets = targets.expand(log_probs.size()[:-1]).unsqueeze(-1)
+        targets = torch.zeros_like(log_probs).scatter_(-1, targets, 1)
         targets = (1 - self.epsilon) * targets + self.epsilon / self.num_classes
-        return (- targets * log_probs).mean(0).sum()
\ No newline at end of file
+        return (- targets * log_probs).sum(-1).mean(-1)
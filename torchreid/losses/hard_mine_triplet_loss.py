@@ -20,31 +20,31 @@ class TripletLoss(nn.Module):
     def __init__(self, margin=0.3):
         super(TripletLoss, self).__init__()
         self.margin = margin
-        self.ranking_loss = nn.MarginRankingLoss(margin=margin)
 
-    def forward(self, inputs, targets):
+    def forward(self, inputs, targets, pos_mask=None, neg_mask=None):
         """
         Args:
             inputs (torch.Tensor): feature matrix with shape (batch_size, feat_dim).
             targets (torch.LongTensor): ground truth labels with shape (num_classes).
+            pos_mask (torch.BoolTensor, optional): precomputed (batch_size, batch_size)
+                mask of same-identity pairs. Computed from ``targets`` if not given.
+            neg_mask (torch.BoolTensor, optional): precomputed (batch_size, batch_size)
+                mask of different-identity pairs, i.e. ``~pos_mask``.
         """
-        n = inputs.size(0)
+        inputs = inputs.float()  # pairwise distances are unstable in half precision
         
-        # Compute pairwise distance, replace by the official when merged
-        dist = torch.pow(inputs, 2).sum(dim=1, keepdim=True).expand(n, n)
-        dist = dist + dist.t()
-        dist.addmm_(1, -2, inputs, inputs.t())
+        # Compute pairwise distance
+        sq = torch.pow(inputs, 2).sum(dim=-1, keepdim=True)
+        dist = sq + sq.transpose(-2, -1) - 2 * torch.matmul(inputs, inputs.transpose(-2, -1))
         dist = dist.clamp(min=1e-12).sqrt()  # for numerical stability
         
         # For each anchor, find the hardest positive and negative
-        mask = targets.expand(n, n).eq(targets.expand(n, n).t())
-        dist_ap, dist_an = [], []
-        for i in range(n):
-            dist_ap.append(dist[i][mask[i]].max().unsqueeze(0))
-            dist_an.append(dist[i][mask[i] == 0].min().unsqueeze(0))
-        dist_ap = torch.cat(dist_ap)
-        dist_an = torch.cat(dist_an)
+        if pos_mask is None:
+            pos_mask = targets.unsqueeze(0).eq(targets.unsqueeze(1))
+        if neg_mask is None:
+            neg_mask = ~pos_mask
+        dist_ap = dist.masked_fill(neg_mask, 0).max(dim=-1)[0]
+        dist_an = dist.masked_fill(pos_mask, float('inf')).min(dim=-1)[0]
         
         # Compute ranking hinge loss
-        y = torch.ones_like(dist_an)
-        return self.ranking_loss(dist_an, dist_ap, y)
\ No newline at end of file
+        return (dist_ap - dist_an + self.margin).clamp(min=0).mean(dim=-1)
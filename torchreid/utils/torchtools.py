@@ -93,16 +93,18 @@ def load_checkpoint(fpath):
     return checkpoint
 
 
-def resume_from_checkpoint(fpath, model, optimizer=None):
+def resume_from_checkpoint(fpath, model, optimizer=None, scaler=None):
     r"""Resumes training from a checkpoint.
 
-    This will load (1) model weights and (2) ``state_dict``
-    of optimizer if ``optimizer`` is not None.
+    This will load (1) model weights, (2) ``state_dict``
+    of optimizer if ``optimizer`` is not None and (3) ``state_dict``
+    of the mixed precision grad scaler if ``scaler`` is not None.
 
     Args:
         fpath (str): path to checkpoint.
         model (nn.Module): model.
         optimizer (Optimizer, optional): an Optimizer.
+        scaler (GradScaler, optional): a ``torch.cuda.amp.GradScaler``.
 
     Returns:
         int: start_epoch.
@@ -119,6 +121,9 @@ def resume_from_checkpoint(fpath, model, optimizer=None):
     if optimizer is not None and 'optimizer' in checkpoint.keys():
         optimizer.load_state_dict(checkpoint['optimizer'])
         print('Loaded optimizer')
+    if scaler is not None and checkpoint.get('scaler'):
+        scaler.load_state_dict(checkpoint['scaler'])
+        print('Loaded grad scaler')
     start_epoch = checkpoint['epoch']
     print('Last epoch = {}'.format(start_epoch))
     if 'rank1' in checkpoint.keys():